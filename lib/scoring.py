@@ -2,11 +2,10 @@ from __future__ import annotations
 
 import numpy as np
 import math
-import scipy.stats.mstats as mstats
 
 from abc import ABC, abstractmethod
-from decimal import Decimal, ROUND_DOWN
-from sklearn.metrics import mean_squared_error
+from decimal import Decimal, InvalidOperation, ROUND_DOWN
+from functools import lru_cache
 
 """
 module to compute scores and rewards according to challenge number
@@ -26,22 +25,25 @@ def validate_prediction(assets: [str], predictions: [(str, Decimal)]) -> bool:
     :return: bool
         true iff predictions contain all assets once and only once, and prediction exists for assets not in the list
     """
-    predicted_assets = set([asset for asset, value in predictions])
+    asset_set = frozenset(assets)
 
-    # check if all assets have been predicted and prediction exists for assets not in the list
-    if set(assets) != predicted_assets:
+    # this can only happen when assets are repeated in the dataset (should happen!)
+    if len(asset_set) != len(assets):
         return False
 
     # check if all assets have been predicted only once
-    if len(assets) != len(predictions):
-        return False
-
-    # this can only happen when assets are repeated in the dataset (should happen!)
-    if len(set(assets)) != len(assets):
+    if len(predictions) != len(asset_set):
         return False
 
-    # check if there is any NaN in the predicted values
-    return not any((math.isnan(value) for asset, value in predictions))
+    # check in a single pass that each prediction is for a requested asset, is not repeated and is not NaN
+    seen = set()
+    for asset, value in predictions:
+        if asset not in asset_set or asset in seen:
+            return False
+        if math.isnan(value):
+            return False
+        seen.add(asset)
+    return True
 
 
 def compute_challenge_error(challenge_number: int, predictions: [Decimal], assets_values: [Decimal]) -> float:
@@ -60,15 +62,32 @@ def compute_challenge_error(challenge_number: int, predictions: [Decimal], asset
     return scorer.compute_challenge_error(predictions, assets_values)
 
 
-def compute_challenge_scores(challenge_number: int, participants_errors: [float]) -> [float]:
+def compute_challenge_errors(challenge_number: int, participants_predictions: [[Decimal]],
+                             assets_values: [Decimal]) -> np.ndarray:
+    """computes the challenge errors of many participants at once
+
+    :param challenge_number: int
+        the challenge number
+    :param participants_predictions: [[Decimal]]
+        the lists of predictions of all participants, each ordered by assets
+    :param assets_values: [Decimal]
+        the list of correct values, ordered by assets
+    :return: np.ndarray
+        the Root Mean Square Errors between the predictions of each participant and values
+    """
+    scorer = Scorer.get(challenge_number)
+    return scorer.compute_challenge_errors(participants_predictions, assets_values)
+
+
+def compute_challenge_scores(challenge_number: int, participants_errors: [float]) -> np.ndarray:
     """computes the challenge scores of all participants to a challenge
 
     :param challenge_number: int
         the challenge number
     :param participants_errors: [float]
         the list of errors of all participants
-    :return: [float]
-        the list of challenge scores of all participants
+    :return: np.ndarray
+        the array of challenge scores of all participants
     """
     scorer = Scorer.get(challenge_number)
     return scorer.compute_challenge_scores(participants_errors)
@@ -139,6 +158,7 @@ def compute_stake_rewards(challenge_number: int, stakes: [Decimal], stake_pool:
     return scorer.compute_stake_rewards(stakes, stake_pool)
 
 
+@lru_cache(maxsize=1024)
 def compute_challenge_pool(challenge_number: int, num_predictors: int) -> Decimal:
     """computes the pool to pay challenge rewards for a given challenge
 
@@ -153,6 +173,7 @@ def compute_challenge_pool(challenge_number: int, num_predictors: int) -> Decima
     return scorer.compute_challenge_pool(num_predictors)
 
 
+@lru_cache(maxsize=1024)
 def compute_competition_pool(challenge_number: int, num_predictors: int) -> Decimal:
     """computes the pool to pay competition rewards for a given challenge
 
@@ -167,6 +188,7 @@ def compute_competition_pool(challenge_number: int, num_predictors: int) -> Deci
     return scorer.compute_competition_pool(num_predictors)
 
 
+@lru_cache(maxsize=1024)
 def compute_stake_pool(challenge_number: int, num_predictors: int, num_stakers: int) -> Decimal:
     """ computes the pool to pay stake rewards for a given challenge
 
@@ -215,13 +237,18 @@ class Scorer (ABC):
 
     TOTAL_WEEKLY_POOL = dec(200000)
     REWARD_PRECISION = "0.0000000001"  # 10 decimal digits
+    _REWARD_PREC = dec(REWARD_PRECISION)
 
     @abstractmethod
     def compute_challenge_error(self, predictions: [Decimal], assets_values: [Decimal]) -> float:
         pass
 
     @abstractmethod
-    def compute_challenge_scores(self, participants_errors: [float]) -> [float]:
+    def compute_challenge_errors(self, participants_predictions: [[Decimal]], assets_values: [Decimal]) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def compute_challenge_scores(self, participants_errors: [float]) -> np.ndarray:
         pass
 
     @abstractmethod
@@ -271,8 +298,9 @@ class Scorer (ABC):
         pass
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get(challenge_number: int) -> Scorer:
-        """returns the scorer valid at a given challenge
+        """returns the scorer valid at a given challenge (scorers are stateless, so one instance is shared)
 
         :param challenge_number:
             the challenge number
@@ -302,27 +330,41 @@ class Scorer1 (Scorer, ABC):
     COMPETITION_REWARD_PERC = dec("0.6")
     STAKE_REWARD_PERC = dec("0.2")
 
-    def compute_challenge_error(self, predictions: [Decimal], assets_values: [Decimal]) -> float:
-        float_predictions = np.array(predictions, dtype=float)
-        float_assets_values = np.array(assets_values, dtype=float)
-        return mean_squared_error(float_predictions, float_assets_values, squared=False)
+    # pool coefficients per participant and pool caps
+    _CHALLENGE_POOL_UNIT = UNIT_WEEKLY_POOL * CHALLENGE_REWARD_PERC
+    _COMPETITION_POOL_UNIT = UNIT_WEEKLY_POOL * COMPETITION_REWARD_PERC
+    _STAKE_POOL_UNIT = UNIT_WEEKLY_POOL * STAKE_REWARD_PERC
+    _CHALLENGE_POOL_MAX = Scorer.TOTAL_WEEKLY_POOL * CHALLENGE_REWARD_PERC
+    _COMPETITION_POOL_MAX = Scorer.TOTAL_WEEKLY_POOL * COMPETITION_REWARD_PERC
+    _STAKE_POOL_MAX = Scorer.TOTAL_WEEKLY_POOL * STAKE_REWARD_PERC
 
-    def compute_challenge_scores(self, participants_errors: [float]) -> [float]:
-        n = np.count_nonzero(~np.isnan(participants_errors))
+    def compute_challenge_error(self, predictions: [Decimal], assets_values: [Decimal]) -> float:
+        if len(predictions) != len(assets_values):
+            raise ValueError(f"{len(predictions)} predictions for {len(assets_values)} asset values")
+        differences = np.asarray(predictions, dtype=float) - np.asarray(assets_values, dtype=float)
+        return float(np.sqrt(differences.dot(differences) / differences.size))
+
+    def compute_challenge_errors(self, participants_predictions: [[Decimal]], assets_values: [Decimal]) -> np.ndarray:
+        values = np.asarray(assets_values, dtype=float)
+        predictions = np.asarray(participants_predictions, dtype=float)
+        differences = predictions.reshape(len(participants_predictions), values.size) - values
+        return np.sqrt(np.einsum("ij,ij->i", differences, differences) / values.size)
+
+    def compute_challenge_scores(self, participants_errors: [float]) -> np.ndarray:
+        errors = Scorer1._to_floats(participants_errors)
+        nan_mask = np.isnan(errors)
+        n = errors.size - np.count_nonzero(nan_mask)
         if n == 0:
-            return [np.nan] * len(participants_errors)
+            return np.full(errors.size, np.nan)
 
-        ranks = mstats.rankdata(np.ma.masked_invalid(participants_errors))
-        ranks[ranks == 0] = np.nan
-        return [(n - r) / (n - 1) for r in ranks]
+        ranks = Scorer1._rank(errors, nan_mask)
+        return (n - ranks) / (n - 1)
 
     def compute_competition_score(self, challenge_scores: [float]) -> float:
         window_size = self.get_window_size()
-        scores = challenge_scores[-window_size:]
-        num_skips = window_size - len(scores)
-        for score in scores:
-            if math.isnan(score):
-                num_skips = num_skips + 1
+        scores = Scorer1._to_floats(challenge_scores[-window_size:])
+        nan_mask = np.isnan(scores)
+        num_skips = window_size - scores.size + np.count_nonzero(nan_mask)
         if num_skips == window_size:
             return np.nan
         a = np.nanmean(scores)
@@ -331,45 +373,64 @@ class Scorer1 (Scorer, ABC):
         return max(a - (b + c), 0)
 
     def compute_challenge_rewards(self, challenge_scores: [float], challenge_pool: Decimal) -> [Decimal]:
-        challenge_scores = [score if not np.isnan(score) else 0 for score in challenge_scores]
-        factors = [max(dec(score) - dec("0.25"), dec(0)) for score in challenge_scores]
-        return Scorer1._distribute(factors, challenge_pool)
+        scores = Scorer1._to_floats(challenge_scores)
+        factors = np.maximum(np.where(np.isnan(scores), 0.0, scores) - 0.25, 0.0)
+        return Scorer1._distribute(Scorer1._to_decimals(factors), challenge_pool)
 
     def compute_competition_rewards(self, competition_scores: [float],
                                     _challenge_scores: [float], competition_pool: Decimal) -> [Decimal]:
-        n = np.count_nonzero(~np.isnan(competition_scores))
+        scores = Scorer1._to_floats(competition_scores)
+        nan_mask = np.isnan(scores)
+        n = scores.size - np.count_nonzero(nan_mask)
         if n == 0:
-            return [0] * len(competition_scores)
+            return [0] * len(scores)
 
-        ranks = mstats.rankdata(np.ma.masked_invalid(competition_scores))
-        ranks[ranks == 0] = np.nan
-        ranks = [(r - 1) / (n - 1) if not np.isnan(r) else 0 for r in ranks]
-        factors = [max(dec(rank) - dec("0.5"), dec(0)) for rank in ranks]
-        return Scorer1._distribute(factors, competition_pool)
+        ranks = Scorer1._rank(scores, nan_mask)
+        factors = np.maximum(np.where(nan_mask, 0.0, (ranks - 1) / (n - 1)) - 0.5, 0.0)
+        return Scorer1._distribute(Scorer1._to_decimals(factors), competition_pool)
 
     def compute_stake_rewards(self, stakes: [Decimal], stake_pool: Decimal) -> [Decimal]:
         return Scorer1._distribute(stakes, stake_pool)
 
     def compute_challenge_pool(self, num_predictors: int) -> Decimal:
-        max_pool = Scorer.TOTAL_WEEKLY_POOL * Scorer1.CHALLENGE_REWARD_PERC
-        pool = Scorer1.UNIT_WEEKLY_POOL * Scorer1.CHALLENGE_REWARD_PERC * num_predictors
-        return min(pool, max_pool)
+        return min(Scorer1._CHALLENGE_POOL_UNIT * num_predictors, Scorer1._CHALLENGE_POOL_MAX)
 
     def compute_competition_pool(self, num_predictors: int) -> Decimal:
-        max_pool = Scorer.TOTAL_WEEKLY_POOL * Scorer1.COMPETITION_REWARD_PERC
-        pool = Scorer1.UNIT_WEEKLY_POOL * Scorer1.COMPETITION_REWARD_PERC * num_predictors
-        return min(pool, max_pool)
+        return min(Scorer1._COMPETITION_POOL_UNIT * num_predictors, Scorer1._COMPETITION_POOL_MAX)
 
     def compute_stake_pool(self, num_predictors: int, num_stakers: int) -> Decimal:
-        max_pool = Scorer.TOTAL_WEEKLY_POOL * Scorer1.STAKE_REWARD_PERC
-        pool = Scorer1.UNIT_WEEKLY_POOL * Scorer1.STAKE_REWARD_PERC * num_predictors
-        return min(pool, max_pool)
+        return min(Scorer1._STAKE_POOL_UNIT * num_predictors, Scorer1._STAKE_POOL_MAX)
+
+    @staticmethod
+    def _to_floats(values: [float]) -> np.ndarray:
+        # convert each value with float(), so that missing values (None) raise instead of becoming NaN
+        return np.fromiter(map(float, values), dtype=np.float64, count=len(values))
+
+    @staticmethod
+    def _rank(values: np.ndarray, nan_mask: np.ndarray) -> np.ndarray:
+        """ranks values in ascending order starting from 1, averaging ties; NaNs (given by nan_mask) stay NaN"""
+        ranks = np.full(values.shape, np.nan)
+        finite = ~nan_mask
+        _, inverse, counts = np.unique(values[finite], return_inverse=True, return_counts=True)
+        ranks[finite] = (np.cumsum(counts) - (counts - 1) / 2)[inverse]
+        return ranks
 
     @staticmethod
     def _distribute(factors: [Decimal], pool: Decimal) -> [Decimal]:
+        # quantum and rounding are bound locally and passed positionally, as they are used once per factor
+        quantum, rounding = Scorer._REWARD_PREC, ROUND_DOWN
         total = sum(factors)
-        return [((pool * factor) / total).quantize(Decimal(Scorer.REWARD_PRECISION), rounding=ROUND_DOWN).normalize()
-                for factor in factors]
+        return [(pool * factor / total).quantize(quantum, rounding).normalize() for factor in factors]
+
+    @staticmethod
+    def _to_decimals(values: np.ndarray) -> [Decimal]:
+        # float factors are computed exactly, the unary plus rounds them to the context precision
+        # as the Decimal arithmetic they replace, so that rewards are the same as the ones paid
+        if np.isnan(values).any():
+            # reproduces a quirk of the original Decimal max(), which raised on the NaN factor produced
+            # when a single competition score is ranked; not an intended limitation
+            raise InvalidOperation("NaN reward factor")
+        return [+dec(value) for value in values.tolist()]
 
 
 class ScorerFrom1To4 (Scorer1):
@@ -380,9 +441,7 @@ class ScorerFrom1To4 (Scorer1):
     WINDOW_SIZE = 4
 
     def compute_stake_pool(self, num_predictors: int, num_stakers: int) -> Decimal:
-        max_pool = Scorer.TOTAL_WEEKLY_POOL * Scorer1.STAKE_REWARD_PERC
-        pool = Scorer1.UNIT_WEEKLY_POOL * Scorer1.STAKE_REWARD_PERC * num_stakers
-        return min(pool, max_pool)
+        return min(Scorer1._STAKE_POOL_UNIT * num_stakers, Scorer1._STAKE_POOL_MAX)
 
     def get_std_dev_penalty(self):
         return self.STDDEV_PENALTY
@@ -405,7 +464,7 @@ class ScorerAt5 (Scorer1):
     # to give all the same they would have got if they were arrived first
     def compute_challenge_rewards(self, challenge_scores: [float], challenge_pool: Decimal) -> [Decimal]:
         return [(challenge_pool / ScorerAt5.CHALLENGE_5_PREDICTORS)
-                .quantize(Decimal(Scorer.REWARD_PRECISION), rounding=ROUND_DOWN).normalize()] \
+                .quantize(Scorer._REWARD_PREC, rounding=ROUND_DOWN).normalize()] \
                * ScorerAt5.CHALLENGE_5_PREDICTORS
 
     # competition rewards are the same for all; an extra has been directly sent to participant wallets
@@ -413,20 +472,20 @@ class ScorerAt5 (Scorer1):
     def compute_competition_rewards(self, competition_scores: [float],
                                     challenge_scores: [float], competition_pool: Decimal) -> [Decimal]:
         return [(competition_pool / ScorerAt5.CHALLENGE_5_PREDICTORS)
-                .quantize(Decimal(Scorer.REWARD_PRECISION), rounding=ROUND_DOWN).normalize()]\
+                .quantize(Scorer._REWARD_PREC, rounding=ROUND_DOWN).normalize()]\
                * ScorerAt5.CHALLENGE_5_PREDICTORS
 
     # override num_predictors, which would be zero because all submissions are invalid
     def compute_challenge_pool(self, num_predictors: int) -> Decimal:
-        return dec(Scorer1.UNIT_WEEKLY_POOL * Scorer1.CHALLENGE_REWARD_PERC * ScorerAt5.CHALLENGE_5_PREDICTORS)
+        return Scorer1._CHALLENGE_POOL_UNIT * ScorerAt5.CHALLENGE_5_PREDICTORS
 
     # override num_predictors, which would be zero because all submissions are invalid
     def compute_competition_pool(self, num_predictors: int) -> Decimal:
-        return dec(Scorer1.UNIT_WEEKLY_POOL * Scorer1.COMPETITION_REWARD_PERC * ScorerAt5.CHALLENGE_5_PREDICTORS)
+        return Scorer1._COMPETITION_POOL_UNIT * ScorerAt5.CHALLENGE_5_PREDICTORS
 
     # override num_predictors, which would be zero because all submissions are invalid
     def compute_stake_pool(self, num_predictors: int, num_stakers: int) -> Decimal:
-        return dec(Scorer1.UNIT_WEEKLY_POOL * Scorer1.STAKE_REWARD_PERC * ScorerAt5.CHALLENGE_5_PREDICTORS)
+        return Scorer1._STAKE_POOL_UNIT * ScorerAt5.CHALLENGE_5_PREDICTORS
 
     def get_std_dev_penalty(self):
         pass
@@ -475,7 +534,7 @@ class ScorerFrom18 (Scorer1):
                                     challenge_scores: [float], competition_pool: Decimal) -> [Decimal]:
 
         # adjust competition scores to be nan if challenge score is nan, i.e., if submission is missing or invalid
-        cs = [np.nan if np.isnan(ch) else co for co, ch in zip(competition_scores, challenge_scores)]
+        cs = [np.nan if math.isnan(ch) else co for co, ch in zip(competition_scores, challenge_scores)]
 
         # use default method on adjusted competition scores
         return Scorer1.compute_competition_rewards(self, cs, challenge_scores, competition_pool)
@@ -1,6 +1,6 @@
 from unittest import TestCase, main
+from decimal import InvalidOperation
 from lib.scoring import *
-import scipy.stats.mstats as mstats
 
 # meaningless constants to improve test readability
 CHALLENGE_1 = 1
@@ -35,6 +35,10 @@ class Test(TestCase):
         prediction = [("AAPL", Decimal("0.1")), ("GOOG", Decimal(math.nan))]
         self.assertFalse(validate_prediction(assets, prediction))
 
+        # prediction with a non numeric entry is rejected with an error
+        prediction = [("AAPL", Decimal("0.1")), ("GOOG", None)]
+        self.assertRaises(TypeError, validate_prediction, assets, prediction)
+
         # this prediction is valid
         prediction = [("AAPL", Decimal("0.1")), ("GOOG", Decimal("0.2"))]
         self.assertTrue(validate_prediction(assets, prediction))
@@ -62,10 +66,40 @@ class Test(TestCase):
         self.assertEqual(dec(0), compute_challenge_error(CHALLENGE_1, [dec(0), dec(1), dec(0), dec(1)],
                                                          [dec(0), dec(1), dec(0), dec(1)]))
 
+        # predictions and values must have the same length
+        self.assertRaises(ValueError, compute_challenge_error, CHALLENGE_1, [dec(1)],
+                          [dec(0), dec(1), dec(0), dec(1)])
+
+    def test_compute_challenge_errors(self):
+        predictions = [[dec(0), dec(1), dec(0), dec(1)],
+                       [dec(0), dec(1), dec(0), dec(1)],
+                       [dec(1), dec(0), dec(1), dec(0)]]
+        values = [dec(0), dec(0), dec(1), dec(1)]
+
+        # batch errors are the same as the errors of each participant
+        errors = compute_challenge_errors(CHALLENGE_1, predictions, values)
+        self.assertEqual(len(predictions), len(errors))
+        for prediction, error in zip(predictions, errors):
+            self.assertAlmostEqual(compute_challenge_error(CHALLENGE_1, prediction, values), error)
+
+        # if there are no participants the batch errors are empty
+        self.assertEqual((0,), compute_challenge_errors(CHALLENGE_1, [], values).shape)
+
+        # a single participant gives a single error
+        errors = compute_challenge_errors(CHALLENGE_1, predictions[:1], values)
+        self.assertEqual((1,), errors.shape)
+        self.assertAlmostEqual(compute_challenge_error(CHALLENGE_1, predictions[0], values), errors[0])
+
+        # predictions must have one value per asset
+        self.assertRaises(ValueError, compute_challenge_errors, CHALLENGE_1,
+                          [[dec(0), dec(1)], [dec(1), dec(0)]], values)
+        self.assertRaises(ValueError, compute_challenge_errors, CHALLENGE_1,
+                          [dec(0), dec(1), dec(0), dec(1)], values)
+
     def test_compute_challenge_scores(self):
 
         # if there are no participants the challenge score list is empty
-        self.assertEqual(compute_challenge_scores(CHALLENGE_1, []), [])
+        self.assertEqual(len(compute_challenge_scores(CHALLENGE_1, [])), 0)
 
         # simple case where errors are all different
         errors = [0, 0.8, 0.2, 1]
@@ -83,8 +117,7 @@ class Test(TestCase):
 
         # simple case with some NaNs
         errors = [0, 0.8, np.nan, 0.2, 1, np.nan]
-        ranks = mstats.rankdata(np.ma.masked_invalid(errors))
-        ranks[ranks == 0] = np.nan
+        ranks = [1, 3, np.nan, 2, 4, np.nan]
         scores = [1 - (r - 1) / 3 for r in ranks]
         for x, y in zip(compute_challenge_scores(CHALLENGE_1, errors), scores):
             if np.isnan(x):
@@ -92,6 +125,9 @@ class Test(TestCase):
             else:
                 self.assertAlmostEqual(x, y)
 
+        # missing errors are not valid
+        self.assertRaises(TypeError, compute_challenge_scores, CHALLENGE_1, [0, None, 0.2])
+
     def test_compute_competition_score(self):
         self._test_compute_competition_score_up_to_17(CHALLENGE_1)
         self._test_compute_competition_score_up_to_17(CHALLENGE_17)
@@ -107,6 +143,9 @@ class Test(TestCase):
         self.assertTrue(
             math.isnan(compute_competition_score(challenge_number, [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan])))
 
+        # missing challenge scores are not valid
+        self.assertRaises(TypeError, compute_competition_score, challenge_number, [0.6, None, 0.6, 0.6])
+
         # competition score with all identical submissions is the last value
         self.assertAlmostEqual(compute_competition_score(challenge_number, [0.6, 0.6, 0.6, 0.6, 0.6, 0.6]), 0.6)
 
@@ -205,6 +244,22 @@ class Test(TestCase):
             competition_score = a - scorer.get_std_dev_penalty() * 2 * b
             self.assertAlmostEqual(compute_competition_score(challenge_number, challenge_scores), competition_score)
 
+    def test_compute_competition_score_with_equal_scores(self):
+
+        # the same scores with the skip in a different slot give the same competition score, hence a tie
+        scores_1 = [0.64718951157425, 0.615385111481254, 0.383677554261883, 0.997209935789211,
+                    0.98083533877623, 0.685541984480695, 0.650459276267816, np.nan]
+        scores_2 = [np.nan, 0.685541984480695, 0.615385111481254, 0.997209935789211,
+                    0.383677554261883, 0.650459276267816, 0.64718951157425, 0.98083533877623]
+        competition_score_1 = compute_competition_score(CHALLENGE_18, scores_1)
+        competition_score_2 = compute_competition_score(CHALLENGE_18, scores_2)
+        self.assertEqual(competition_score_1, competition_score_2)
+
+        # tied participants share the competition rewards equally
+        competition_rewards = compute_competition_rewards(CHALLENGE_18, [competition_score_1, competition_score_2, 0.1],
+                                                          [0.5, 0.5, 0.5], dec(3120))
+        self.assertEqual([dec(1560), dec(1560), dec(0)], competition_rewards)
+
     def test_compute_challenge_rewards(self):
 
         # [0.5, 0.25, 0.75, 1, 0] should give [16.6666666666, 0, 33.3333333333, 50, 0]
@@ -220,6 +275,9 @@ class Test(TestCase):
         challenge_rewards = compute_challenge_rewards(CHALLENGE_1, challenge_scores, challenge_pool)
         self.assertEqual(expected_rewards, challenge_rewards)
 
+        # missing challenge scores are not valid
+        self.assertRaises(TypeError, compute_challenge_rewards, CHALLENGE_1, [0.5, None, 0.75], challenge_pool)
+
         # special case for challenge 5
         expected_rewards = [dec("37.1428571428")] * 28
         challenge_rewards = compute_challenge_rewards(CHALLENGE_5, [], dec(1040))
@@ -244,6 +302,15 @@ class Test(TestCase):
                                                           challenge_scores, competition_pool)
         self.assertEqual(expected_rewards, competition_rewards)
 
+        # missing competition scores are not valid
+        self.assertRaises(TypeError, compute_competition_rewards, CHALLENGE_1,
+                          [0.33, None, 0.6], [0.5, 0.5, 0.5], competition_pool)
+
+        # known limitation kept from the original implementation, documented rather than intended:
+        # a single ranked competition score gives a NaN factor, which raises
+        self.assertRaises(InvalidOperation, compute_competition_rewards, CHALLENGE_1,
+                          [np.nan, 0.33], [0.5, 0.5], competition_pool)
+
         # special case for challenge 5
         expected_rewards = [dec("111.4285714286")] * 28
         competition_rewards = compute_competition_rewards(CHALLENGE_5, [], [], dec(3120))
@@ -272,6 +339,10 @@ class Test(TestCase):
         stake_rewards = compute_stake_rewards(CHALLENGE_1, stakes, stake_pool)
         self.assertEqual(expected_rewards, stake_rewards)
 
+        # rewards follow Decimal arithmetic at context precision, as in the rewards actually paid
+        stakes = [dec("0.6377822946810980386800338237662799656391143798828125")]
+        self.assertEqual([dec("41697.9999999999")], compute_stake_rewards(CHALLENGE_1, stakes, dec(41698)))
+
     def test_compute_challenge_pool(self):
         self.assertEqual(dec(0), compute_challenge_pool(CHALLENGE_1, 0))
         self.assertEqual(dec(1560), compute_challenge_pool(CHALLENGE_1, 39))
@@ -310,6 +381,7 @@ class Test(TestCase):
         self.assertEqual(dec(200000), compute_pool_surplus(CHALLENGE_1, 0, 0))
         self.assertEqual(dec(191800), compute_pool_surplus(CHALLENGE_1, 39, 49))
         self.assertEqual(dec(0), compute_pool_surplus(CHALLENGE_1, 1000, 1000))
+        self.assertEqual(dec(0), compute_pool_surplus(CHALLENGE_1, 2000, 2000))
 
     # two lists differs at most 1e-10
     def assert_almost_equals_00000001(self, xs: [Decimal], ys: [Decimal]) -> None: